@@ -12,6 +12,7 @@ import main
 import profit_calc
 import mffr_price_updater
 import baseline
+import backfill
 
 app = FastAPI()
 DB_FILE = "data/mffr.db"
@@ -60,7 +61,8 @@ def get_mffr_data(
     nf = _normalize_to_local_iso(from_ts)
     nt = _normalize_to_local_iso(to_ts)
 
-    where = []
+    # Provisional rows may still be discarded at close-of-slot
+    where = ["status != 'provisional'"]
     params = []
     if nf:
         where.append("timeslot >= ?")
@@ -68,7 +70,7 @@ def get_mffr_data(
     if nt:
         where.append("timeslot <= ?")
         params.append(nt)
-    where_clause = " AND ".join(where) if where else "1=1"
+    where_clause = " AND ".join(where)
 
     try:
         rows = list(
@@ -88,6 +90,7 @@ def get_mffr_data(
 @app.on_event("startup")
 def start_all_schedulers():
     print("✅ Starting all schedulers from FastAPI")
+    baseline.reset_baseline_table()
     main.write_current_timeslot()
     profit_calc.run_profit_calculation()
     mffr_price_updater.fetch_and_update_mffr_prices()
@@ -97,6 +100,8 @@ def start_all_schedulers():
         profit_calc.scheduler.start()
     if not mffr_price_updater.scheduler.running:
         mffr_price_updater.scheduler.start()
+    if not backfill.scheduler.running:
+        backfill.scheduler.start()
 
     # Start baseline microservice scheduler
     if not baseline.scheduler.running:
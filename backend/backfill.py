@@ -0,0 +1,305 @@
+# backend/backfill.py
+#
+# Recovers slots lost while the collector was down. main.py records collection
+# gaps; this job pulls the sensor histories for each gap from Home Assistant's
+# /api/history/period endpoint in one request, replays them offline through the
+# same slot rules as the live collector and inserts the result in one transaction.
+#
+# Point HA_URL at a local stand-in (ha_standin.py) to run it against canned history:
+#   python backfill.py                       # process pending gaps
+#   python backfill.py <from_iso> <to_iso>   # fill slots with no row yet in a window
+import os
+import sys
+from datetime import datetime, timedelta
+from urllib.parse import quote
+
+import requests
+from apscheduler.schedulers.background import BackgroundScheduler
+from sqlite_utils import Database
+
+import baseline
+import main
+
+DB_PATH = main.DB_PATH
+tz = main.tz
+
+TICK_SECONDS = 10    # same cadence as the live collector
+HISTORY_TIMEOUT = 30
+# A gap that keeps failing (HA down, history purged) is given up after this many runs
+MAX_ATTEMPTS = int(os.getenv("BACKFILL_MAX_ATTEMPTS", "12"))
+
+scheduler = BackgroundScheduler()
+
+def _parse_ts(ts: str) -> datetime:
+    return datetime.fromisoformat(ts.replace("Z", "+00:00")).astimezone(tz)
+
+def fetch_histories(start: datetime, end: datetime, entity_ids: list,
+                    ha_url: str = main.HA_URL, token: str = main.HA_TOKEN) -> dict:
+    """
+    One /api/history/period request for all entities.
+    Returns {entity_id: [(changed_at, state), ...]} sorted by time; unknown and
+    unavailable states are kept as None so they end the previous value.
+    """
+    url = f"{ha_url}/api/history/period/{quote(start.isoformat())}"
+    params = {
+        "end_time": end.isoformat(),
+        "filter_entity_id": ",".join(entity_ids),
+        "minimal_response": "",
+        "no_attributes": "",
+        "significant_changes_only": "0",
+    }
+    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+    resp = requests.get(url, params=params, headers=headers, timeout=HISTORY_TIMEOUT)
+    resp.raise_for_status()
+
+    histories = {entity_id: [] for entity_id in entity_ids}
+    for states in resp.json():
+        if not states:
+            continue
+        # minimal_response: only the first state of each list carries entity_id
+        entity_id = states[0].get("entity_id")
+        if entity_id not in histories:
+            continue
+        for s in states:
+            ts = s.get("last_changed") or s.get("last_updated")
+            if not ts:
+                continue
+            state = s.get("state")
+            if state in ("unknown", "unavailable"):
+                state = None
+            histories[entity_id].append((_parse_ts(ts), state))
+        histories[entity_id].sort(key=lambda item: item[0])
+    return histories
+
+def resample(series: list, ticks: list) -> list:
+    """Step-function value of `series` at each tick (last state at or before it)."""
+    values = []
+    i = 0
+    current = None
+    for t in ticks:
+        while i < len(series) and series[i][0] <= t:
+            current = series[i][1]
+            i += 1
+        values.append(current)
+    return values
+
+def _to_float(value, default=None):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+def rebuild_slots(ticks: list, modes: list, powers: list, grids: list,
+                  emit_after: datetime, seed_baseline_w: float = 0.0,
+                  existing: dict | None = None) -> dict:
+    """
+    Replay resampled sensor values tick by tick.
+    Baseline follows baseline.py (average power of the last slot without a signal);
+    slots follow main.slot_transition. Only ticks after `emit_after` produce
+    segments, earlier ones just warm up the baseline. `existing` rows are only
+    consulted as the previous slot; merging into them is left to _write_segments.
+    Returns {timeslot: segment} covering just the replayed ticks.
+    """
+    existing = existing or {}
+    rows = {}
+
+    baseline_w = seed_baseline_w
+    acc = None
+
+    for now, mode, power, grid in zip(ticks, modes, powers, grids):
+        slot = main.slot_anchor(now)
+        signal = main.mode_to_signal(mode)
+        power_w = _to_float(power)
+
+        # --- baseline, as in baseline.tick() ---
+        if acc is None:
+            acc = baseline.new_accumulator(slot)
+        if slot > acc["slot"]:
+            avg_w = baseline.close_slot(acc)
+            if avg_w is not None:
+                baseline_w = avg_w
+            acc = baseline.new_accumulator(slot)
+        baseline.integrate(acc, now, power_w, signal)
+
+        # --- slot, as in main.write_current_timeslot() ---
+        if now <= emit_after or not signal:
+            continue
+        key = slot.isoformat()
+
+        energy_kwh = main.mffr_energy_kwh(power_w, baseline_w) if power_w is not None else 0.0
+        grid_kwh = main.grid_energy_kwh(_to_float(grid, 0.0))
+        prev_key = (slot - timedelta(minutes=15)).astimezone(tz).isoformat()
+        previous = rows.get(prev_key) or existing.get(prev_key)
+
+        result = main.slot_transition(rows.get(key), previous, now, signal,
+                                      energy_kwh, grid_kwh, baseline_w)
+        if result is None:
+            continue
+        data, is_new = result
+        if is_new:
+            rows[key] = data
+        else:
+            rows[key].update(data)
+    return rows
+
+def _seed_baseline_w(db: Database, before: datetime) -> float:
+    """
+    Baseline in force when the gap began: the snapshot on the last slot before it.
+    baseline_state only holds today's value (and is cleared on startup), so it is
+    a last resort. 0.0 snapshots are skipped, that is the post-restart fallback.
+    """
+    row = db.execute(
+        "SELECT baseline_w FROM slots WHERE timeslot < ? AND baseline_w IS NOT NULL AND baseline_w != 0 "
+        "ORDER BY timeslot DESC LIMIT 1",
+        [before.isoformat()],
+    ).fetchone()
+    return row[0] if row else main.get_latest_baseline_w()
+
+def backfill_window(db: Database, gap_start: datetime, gap_end: datetime) -> list:
+    """Rebuild the slot segments for one gap. Nothing is written here."""
+    # Work in local time so slot keys match the live collector across DST changes
+    gap_start, gap_end = gap_start.astimezone(tz), gap_end.astimezone(tz)
+    warmup_start = (main.slot_anchor(gap_start) - timedelta(minutes=15)).astimezone(tz)
+    entities = [main.SENSOR_MODE, main.SENSOR_POWER, main.SENSOR_GRID, main.SENSOR_NORDPOOL]
+    histories = fetch_histories(warmup_start, gap_end, entities)
+
+    ticks = []
+    t = warmup_start
+    while t < gap_end:
+        ticks.append(t.astimezone(tz))
+        t += timedelta(seconds=TICK_SECONDS)
+
+    # Wall-clock keys are not ordered across the autumn DST change, so look them up by key
+    keys = sorted({main.slot_anchor(t).isoformat() for t in ticks})
+    existing = {
+        row["timeslot"]: row
+        for row in db["slots"].rows_where(
+            f"timeslot IN ({', '.join('?' for _ in keys)})", keys
+        )
+    }
+    rows = rebuild_slots(
+        ticks,
+        resample(histories[main.SENSOR_MODE], ticks),
+        resample(histories[main.SENSOR_POWER], ticks),
+        resample(histories[main.SENSOR_GRID], ticks),
+        emit_after=gap_start,
+        seed_baseline_w=_seed_baseline_w(db, gap_start),
+        existing=existing,
+    )
+
+    if rows:
+        # raw_today/raw_tomorrow only reach back to today; older slots take the
+        # sensor's own state history, sampled mid-slot to stay clear of the update lag
+        try:
+            prices = main.fetch_nordpool_prices()
+        except Exception as e:
+            print(f"❌ Backfill could not fetch Nordpool prices: {e}")
+            prices = []
+        midpoints = [datetime.fromisoformat(key) + timedelta(minutes=7.5) for key in rows]
+        history_prices = resample(histories[main.SENSOR_NORDPOOL], midpoints)
+        for (key, row), fallback in zip(rows.items(), history_prices):
+            price = main.nordpool_price_for(prices, datetime.fromisoformat(key))
+            if price is None and _to_float(fallback) is not None:
+                price = round(_to_float(fallback), 5)
+            row["nordpool_price"] = price
+    return list(rows.values())
+
+def _close_if_ended(row: dict, close_before: datetime) -> dict | None:
+    """main.close_finished_slots for one row: None means discard."""
+    if datetime.fromisoformat(row["slot_end"]) > close_before:
+        return row
+    if row["status"] == "provisional":
+        return None
+    return {**row, "status": "closed"}
+
+def _write_segments(db: Database, segments: list, close_before: datetime,
+                    gap_key: str | None = None, merge: bool = True) -> int:
+    """
+    Insert or merge rebuilt segments (and mark the gap done) in a single transaction.
+    Segments for slots the collector wrote around the outage are merged into the
+    stored row via main.merge_slot instead of being dropped. That is only sound for
+    a recorded gap, whose ticks the collector never saw; with merge=False stored
+    rows are left alone.
+    """
+    now = datetime.now(tz).isoformat()
+    written = 0
+    with db.conn:
+        # The collector takes the same lock for its read-modify-write, so neither
+        # side can overwrite the other with a stale copy of the row
+        db.conn.execute("BEGIN IMMEDIATE")
+        for segment in segments:
+            key = segment["timeslot"]
+            current = main.read_slot(db, key)
+            if current is None:
+                row = _close_if_ended(segment, close_before)
+                if row is None:
+                    continue
+                main.write_slot(db, key, row, True)
+            elif not merge:
+                continue
+            else:
+                changes = main.merge_slot(current, segment)
+                if changes is None:
+                    continue
+                if changes.get("status") != "closed":
+                    merged = _close_if_ended({**current, **changes}, close_before)
+                    if merged is not None:
+                        changes["status"] = merged["status"]
+                main.write_slot(db, key, changes, False)
+            written += 1
+        if gap_key is not None:
+            db.conn.execute(
+                "UPDATE collection_gaps SET backfilled_at = ?, slots_added = ? WHERE gap_start = ?",
+                (now, written, gap_key),
+            )
+    return written
+
+def backfill_gaps():
+    db = Database(DB_PATH)
+    main._with_busy_timeout(db)
+
+    pending = db["collection_gaps"].rows_where(
+        "backfilled_at IS NULL AND coalesce(attempts, 0) < ?", [MAX_ATTEMPTS], order_by="gap_start"
+    )
+    for gap in list(pending):
+        try:
+            gap_start = datetime.fromisoformat(gap["gap_start"])
+            gap_end = datetime.fromisoformat(gap["gap_end"])
+            segments = backfill_window(db, gap_start, gap_end)
+            written = _write_segments(db, segments, gap_end, gap_key=gap["gap_start"])
+            print(f"🩹 Backfilled {written} slots for gap {gap['gap_start']} → {gap['gap_end']}")
+        except Exception as e:
+            # Left pending and retried on the next run, up to MAX_ATTEMPTS
+            print(f"❌ Backfill failed for gap {gap['gap_start']}: {e}")
+            try:
+                with db.conn:
+                    db.conn.execute(
+                        "UPDATE collection_gaps SET attempts = coalesce(attempts, 0) + 1, last_error = ? "
+                        "WHERE gap_start = ?",
+                        (str(e), gap["gap_start"]),
+                    )
+            except Exception as e2:
+                print(f"❌ Could not record backfill failure: {e2}")
+
+# Scheduler is started by FastAPI (api.py); the first run is due straight away
+# but happens on the scheduler thread, so a slow or absent HA does not hold up startup
+scheduler.add_job(
+    backfill_gaps,
+    "interval",
+    minutes=5,
+    next_run_time=datetime.now(tz),
+    misfire_grace_time=None,
+    max_instances=1,
+    coalesce=True
+)
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3:
+        db = Database(DB_PATH)
+        main._with_busy_timeout(db)
+        window_end = _parse_ts(sys.argv[2])
+        segments = backfill_window(db, _parse_ts(sys.argv[1]), window_end)
+        # An arbitrary window may overlap recorded ticks or an earlier run: insert only
+        print(f"🩹 Backfilled {_write_segments(db, segments, window_end, merge=False)} slots")
+    else:
+        backfill_gaps()
@@ -55,13 +55,7 @@ def reset_baseline_table():
     except Exception as e:
         print(f"❌ Failed to clear baseline_state: {e}")
 
-reset_baseline_table()
-
-_prev_t = None
-_prev_p = None
-accum_Wh = 0.0
-saw_mffr = False
-current_slot = None
+_acc = None  # accumulator for the slot being measured
 
 def _mode_to_signal(mode: str | None):
     if not mode:
@@ -76,6 +70,28 @@ def _mode_to_signal(mode: str | None):
 def _slot_anchor(dt: datetime):
     return dt.replace(minute=(dt.minute // 15) * 15, second=0, microsecond=0)
 
+def new_accumulator(slot: datetime) -> dict:
+    return {"slot": slot, "prev_t": None, "prev_p": None, "accum_Wh": 0.0, "saw_mffr": False}
+
+def integrate(acc: dict, now: datetime, power_w: float | None, signal: str | None):
+    """Add one power sample to the slot accumulator (left Riemann sum)."""
+    if signal and not acc["saw_mffr"]:
+        acc["saw_mffr"] = True
+    if power_w is not None:
+        if acc["prev_t"] is not None and acc["prev_p"] is not None:
+            dt_s = (now - acc["prev_t"]).total_seconds()
+            if dt_s > 0:
+                acc["accum_Wh"] += (acc["prev_p"] * dt_s) / 3600.0
+        acc["prev_t"] = now
+        acc["prev_p"] = power_w
+
+def close_slot(acc: dict) -> float | None:
+    """Average power of a finished slot, or None if it saw a signal or no energy."""
+    EPS = 1e-6
+    if abs(acc["accum_Wh"]) > EPS and not acc["saw_mffr"]:
+        return round((acc["accum_Wh"] * 3600.0) / 900.0, 2)
+    return None
+
 def _ha_state(entity_id: str):
     try:
         r = requests.get(
@@ -91,28 +107,27 @@ def _ha_state(entity_id: str):
         return None
 
 def tick():
-    global _prev_t, _prev_p, accum_Wh, saw_mffr, current_slot
+    global _acc
     now = datetime.now(tz)
     slot = _slot_anchor(now)
 
-    if current_slot is None:
-        current_slot = slot
+    if _acc is None:
+        _acc = new_accumulator(slot)
 
-    if slot > current_slot:
-        EPS = 1e-6
-        if abs(accum_Wh) > EPS and not saw_mffr:
-            avg_w = round((accum_Wh * 3600.0) / 900.0, 2)
+    if slot > _acc["slot"]:
+        avg_w = close_slot(_acc)
+        if avg_w is not None:
             try:
                 db = _open_db()
                 with db.conn:
                     db["baseline_state"].upsert({
                         "key": "latest",
                         "baseline_w": avg_w,
-                        "computed_for_slot": current_slot.isoformat(),
-                        "energy_Wh": round(accum_Wh, 3),
+                        "computed_for_slot": _acc["slot"].isoformat(),
+                        "energy_Wh": round(_acc["accum_Wh"], 3),
                         "updated_at": now.isoformat()
                     }, pk="key")
-                dlog(f"Updated baseline: {avg_w} W (slot {current_slot.isoformat()}, energy {accum_Wh:.3f} Wh)")
+                dlog(f"Updated baseline: {avg_w} W (slot {_acc['slot'].isoformat()}, energy {_acc['accum_Wh']:.3f} Wh)")
             except Exception:
                 pass
             finally:
@@ -121,11 +136,7 @@ def tick():
                 except Exception:
                     pass
 
-        current_slot = slot
-        _prev_t = None
-        _prev_p = None
-        accum_Wh = 0.0
-        saw_mffr = False
+        _acc = new_accumulator(slot)
 
     p = _ha_state(SENSOR_POWER)
     if p is not None:
@@ -135,24 +146,14 @@ def tick():
             p = None
 
     mode = _ha_state(SENSOR_MODE)
-    sig = _mode_to_signal(mode)
-    if sig and not saw_mffr:
-        saw_mffr = True
-
-    if p is not None:
-        if _prev_t is not None and _prev_p is not None:
-            dt_s = (now - _prev_t).total_seconds()
-            if dt_s > 0:
-                dE = (_prev_p * dt_s) / 3600.0
-                accum_Wh += dE
-        _prev_t = now
-        _prev_p = p
+    integrate(_acc, now, p, _mode_to_signal(mode))
 
 scheduler = BackgroundScheduler()
 scheduler.add_job(tick, "interval", seconds=10, max_instances=1, coalesce=True)
 
 if __name__ == "__main__":
     print("▶️ baseline service started")
+    reset_baseline_table()
     scheduler.start()
     import time
     while True:
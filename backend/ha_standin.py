@@ -0,0 +1,170 @@
+# backend/ha_standin.py
+#
+# Minimal Home Assistant stand-in for exercising backfill.py without a real HA.
+# Serves /api/history/period/<start> and /api/states/<entity_id> from a JSON
+# fixture shaped like:
+#   {"history": {"<entity_id>": [["<iso time>", "<state>"], ...]},
+#    "states":  {"<entity_id>": {"state": "...", "attributes": {...}}}}
+#
+#   python ha_standin.py fixture.json [port]   # serve; point HA_URL at it
+#   python ha_standin.py --check               # backfill a built-in outage and verify the slots
+import json
+import os
+import sys
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+def _parse(ts: str) -> datetime:
+    return datetime.fromisoformat(ts.replace("Z", "+00:00"))
+
+def make_handler(fixture: dict):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status: int, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = parse_qs(url.query, keep_blank_values=True)
+            if url.path.startswith("/api/history/period/"):
+                start = _parse(unquote(url.path[len("/api/history/period/"):]))
+                end = _parse(query["end_time"][0]) if "end_time" in query else start + timedelta(days=1)
+                entity_ids = query.get("filter_entity_id", [""])[0].split(",")
+                self._send(200, [self._history(e, start, end) for e in entity_ids
+                                 if fixture["history"].get(e)])
+            elif url.path.startswith("/api/states/"):
+                state = fixture.get("states", {}).get(url.path[len("/api/states/"):])
+                if state is None:
+                    self._send(404, {"message": "Entity not found."})
+                else:
+                    self._send(200, state)
+            else:
+                self._send(404, {"message": "Not found"})
+
+        def _history(self, entity_id: str, start: datetime, end: datetime) -> list:
+            # Like HA: the state in force at `start` comes first, stamped with `start`;
+            # with minimal_response only that first entry carries the entity_id
+            changes = sorted((_parse(ts), state) for ts, state in fixture["history"][entity_id])
+            initial = [state for ts, state in changes if ts <= start]
+            out = []
+            if initial:
+                out.append({"entity_id": entity_id, "state": initial[-1], "last_changed": start.isoformat()})
+            for ts, state in changes:
+                if start < ts <= end:
+                    out.append({"state": state, "last_changed": ts.isoformat()})
+            if out and "entity_id" not in out[0]:
+                out[0]["entity_id"] = entity_id
+            return out
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+def serve(fixture: dict, port: int = 0) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(fixture))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def check():
+    """
+    Outage 10:05:00-10:41:00 during a Fusebox Sell activation 10:00:20-10:52:00.
+    The collector wrote the first minutes of 10:00 before it died and the first
+    tick of 10:30 after it came back; the backfill has to complete both rows and
+    rebuild 10:15 from history.
+    """
+    t0 = datetime.fromisoformat("2026-06-01T10:00:00+03:00")
+    at = lambda minutes, seconds=0: (t0 + timedelta(minutes=minutes, seconds=seconds)).isoformat()
+    fixture = {
+        "history": {
+            "input_select.battery_mode": [[at(-60), "Idle"], [at(0, 20), "Fusebox Sell"], [at(52), "Idle"]],
+            "sensor.battery_power": [[at(-60), "200"], [at(0, 20), "5200"], [at(52), "200"]],
+            "sensor.grid_power": [[at(-60), "-1000"]],
+            "sensor.nordpool": [[at(-60), "0.1"], [at(15), "0.12345"]],
+        },
+        "states": {"sensor.nordpool": {"state": "0.2", "attributes": {}}},
+    }
+    server = serve(fixture)
+
+    workdir = tempfile.mkdtemp(prefix="mffr-standin-")
+    os.makedirs(os.path.join(workdir, "data"))
+    os.chdir(workdir)
+    os.environ.update({
+        "HA_URL": f"http://127.0.0.1:{server.server_port}",
+        "HA_TOKEN": "standin",
+        "SENSOR_MODE": "input_select.battery_mode",
+        "SENSOR_POWER": "sensor.battery_power",
+        "SENSOR_GRID": "sensor.grid_power",
+        "SENSOR_NORDPOOL": "sensor.nordpool",
+    })
+    import backfill
+    import main
+    from sqlite_utils import Database
+
+    db = Database(main.DB_PATH)
+    # What the live collector left behind: 10:00:20-10:05:00 before the outage,
+    # one tick at 10:41:00 after it (late start, so it looks like a backup slot)
+    db["slots"].insert_all([
+        {"timeslot": at(0), "start": at(0, 20), "end": at(5), "signal": "UP", "energy_kwh": 0.38889,
+         "grid_kwh": -0.07778, "duration_min": 5, "cancelled": True, "was_backup": True,
+         "slot_end": at(15), "baseline_w": 200.0, "status": "active"},
+        {"timeslot": at(30), "start": at(41), "end": at(41), "signal": "UP", "energy_kwh": 0.01389,
+         "grid_kwh": -0.00278, "duration_min": 0, "cancelled": False, "was_backup": False,
+         "slot_end": at(45), "baseline_w": 200.0, "status": "provisional"},
+    ], pk="timeslot")
+    db["collection_gaps"].insert({"gap_start": at(5), "gap_end": at(41), "detected_at": at(41)})
+
+    backfill.backfill_gaps()
+    slots = {row["timeslot"]: row for row in db["slots"].rows_where(order_by="timeslot")}
+    gap = db["collection_gaps"].get(at(5))
+    server.shutdown()
+
+    failures = []
+    def expect(what, actual, wanted):
+        if actual != wanted:
+            failures.append(f"{what}: {actual!r} != {wanted!r}")
+
+    expect("gap backfilled", gap["backfilled_at"] is not None, True)
+    expect("slots", sorted(slots), [at(0), at(15), at(30)])
+    expect("10:00 start", slots[at(0)]["start"], at(0, 20))
+    expect("10:00 end", slots[at(0)]["end"], at(14, 50))
+    expect("10:00 duration", slots[at(0)]["duration_min"], 14)
+    expect("10:00 cancelled", slots[at(0)]["cancelled"], 0)
+    expect("10:00 status", slots[at(0)]["status"], "closed")
+    expect("10:15 duration", slots[at(15)]["duration_min"], 15)
+    # baseline.py over the idle 09:45 slot: 89 intervals of 200 W spread over 900 s
+    expect("10:15 baseline", slots[at(15)]["baseline_w"], 197.78)
+    expect("10:15 nordpool", slots[at(15)]["nordpool_price"], 0.12345)
+    expect("10:15 status", slots[at(15)]["status"], "closed")
+    expect("10:30 start", slots[at(30)]["start"], at(30, 10))
+    expect("10:30 end", slots[at(30)]["end"], at(41))
+    expect("10:30 was_backup", slots[at(30)]["was_backup"], 0)
+    expect("10:30 status", slots[at(30)]["status"], "active")
+    # 89 ticks (10:15:10-10:29:50) of 5200 W above that baseline
+    expect("10:15 energy", round(slots[at(15)]["energy_kwh"], 3), 1.237)
+
+    for line in failures:
+        print(f"❌ {line}")
+    if failures:
+        sys.exit(1)
+    print(f"✅ Backfill against the HA stand-in OK ({workdir})")
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["--check"]:
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        check()
+    elif len(sys.argv) in (2, 3):
+        with open(sys.argv[1]) as f:
+            server = serve(json.load(f), int(sys.argv[2]) if len(sys.argv) == 3 else 8123)
+        print(f"▶️ HA stand-in on http://127.0.0.1:{server.server_port}")
+        threading.Event().wait()
+    else:
+        print("usage: python ha_standin.py fixture.json [port] | --check")
+        sys.exit(2)
@@ -51,17 +51,70 @@ required_columns = {
     "net_total": float,
     "price_per_kwh": float,
     "grid_kwh": float,     # legacy safety
-    "baseline_w": float    # snapshot of baseline per slot
+    "baseline_w": float,   # snapshot of baseline per slot
+    "status": str          # provisional → active → closed → settled
 }
 for column, col_type in required_columns.items():
     if column not in init_db["slots"].columns_dict:
         print(f"🛠️  Adding missing column '{column}' to 'slots' table")
         init_db["slots"].add_column(column, col_type)
 
+# Slot lifecycle:
+#   provisional  inserted on the first tick of a signal (duration_min = 0)
+#   active       signal confirmed (duration_min > 0), still being written
+#   closed       slot_end passed; waiting for prices and settlement
+#   settled      profit computed by profit_calc.py
+# Provisional rows still around at close-of-slot are discarded.
+init_db.conn.execute("""
+    UPDATE slots SET status = CASE
+        WHEN profit IS NOT NULL AND net_total IS NOT NULL THEN 'settled'
+        WHEN duration_min > 0 THEN 'active'
+        ELSE 'provisional'
+    END
+    WHERE status IS NULL
+""")
+init_db.conn.commit()
+
 init_db["slots"].create_index(["timeslot"], if_not_exists=True)
-init_db["slots"].create_index(["duration_min", "end"], if_not_exists=True)
+# Only served the old per-minute zero-duration delete
+init_db.conn.execute("DROP INDEX IF EXISTS idx_slots_duration_min_end")
+# Settled rows are the bulk of the table, so lifecycle work goes through a partial
+# index over the rest. SQLite only picks a partial index when the query repeats its
+# WHERE term verbatim; build those filters with open_slots_where().
+UNSETTLED = "status != 'settled'"
+init_db.conn.execute(
+    f"CREATE INDEX IF NOT EXISTS idx_slots_open ON slots(status, slot_end) WHERE {UNSETTLED}"
+)
+
+# Collector liveness, used to detect outages that backfill.py later recovers from HA history
+init_db["collector_state"].create({
+    "key": str,
+    "last_tick": str,
+}, pk="key", if_not_exists=True)
+init_db["collection_gaps"].create({
+    "gap_start": str,
+    "gap_end": str,
+    "detected_at": str,
+    "backfilled_at": str,
+    "slots_added": int,
+    "attempts": int,
+    "last_error": str,
+}, pk="gap_start", if_not_exists=True)
+for column, col_type in {"attempts": int, "last_error": str}.items():
+    if column not in init_db["collection_gaps"].columns_dict:
+        init_db["collection_gaps"].add_column(column, col_type)
+
+# A gap is recorded when consecutive successful polls are further apart than this
+GAP_MIN_SECONDS = int(os.getenv("GAP_MIN_SECONDS", "60"))
+# A provisional row not extended for this long is replaced rather than resumed
+PROVISIONAL_STALE_SECONDS = 120
+# How often the heartbeat is persisted (kept in memory between writes)
+HEARTBEAT_SECONDS = 60
 
 last_logged_signal = None
+_last_closed_slot = None
+_last_tick = None
+_last_heartbeat_write = None
 
 def _with_busy_timeout(db: Database, ms: int = 5000):
     try:
@@ -91,44 +144,272 @@ def get_latest_baseline_w() -> float:
     except Exception:
         return 0.0  # Default fallback if not available
 
-def cleanup_zero_min_rows():
-    db = Database(DB_PATH)
-    _with_busy_timeout(db)
+def fetch_nordpool_prices() -> list:
+    resp = requests.get(
+        f"{HA_URL}/api/states/{SENSOR_NORDPOOL}",
+        headers={"Authorization": f"Bearer {HA_TOKEN}", "Content-Type": "application/json"},
+        timeout=5,
+    )
+    attrs = resp.json().get("attributes", {}) if resp.ok else {}
+    raw_today = attrs.get("raw_today", []) or []
+    raw_tomorrow = attrs.get("raw_tomorrow", []) or []
+    return raw_today + raw_tomorrow
+
+def nordpool_price_for(prices: list, timeslot: datetime) -> float | None:
+    for p in prices:
+        start = datetime.fromisoformat(p["start"])
+        end = datetime.fromisoformat(p["end"])
+        if start <= timeslot < end:
+            return round(p["value"], 5)
+    return None
+
+def touch_heartbeat(db: Database, now: datetime):
+    """Track successful polls and record a collection gap when they stop for too long."""
+    global _last_tick, _last_heartbeat_write
+    previous = _last_tick
+    if previous is None:
+        # First poll after (re)start: compare against the persisted heartbeat
+        try:
+            previous = datetime.fromisoformat(db["collector_state"].get("latest")["last_tick"])
+        except (NotFoundError, TypeError, ValueError):
+            previous = None
+        if previous is not None:
+            # The heartbeat lags up to HEARTBEAT_SECONDS, but an activation row is written
+            # on every poll; its end keeps the backfilled ticks disjoint from the stored ones
+            last_end = db.execute(
+                "SELECT max([end]) FROM slots WHERE timeslot >= ?",
+                [(slot_anchor(previous) - timedelta(minutes=15)).astimezone(tz).isoformat()],
+            ).fetchone()[0]
+            if last_end and datetime.fromisoformat(last_end) > previous:
+                previous = datetime.fromisoformat(last_end)
+    _last_tick = now
+
+    gap = previous is not None and (now - previous).total_seconds() > GAP_MIN_SECONDS
+    if not gap and _last_heartbeat_write is not None and \
+            (now - _last_heartbeat_write).total_seconds() < HEARTBEAT_SECONDS:
+        return
+
     try:
-        cutoff = (datetime.now(tz) - timedelta(minutes=2)).isoformat()
         with db.conn:
+            if gap:
+                db.conn.execute(
+                    "INSERT OR IGNORE INTO collection_gaps (gap_start, gap_end, detected_at) VALUES (?, ?, ?)",
+                    (previous.isoformat(), now.isoformat(), now.isoformat())
+                )
             db.conn.execute(
-                "DELETE FROM slots WHERE duration_min = 0 AND end < ?",
-                (cutoff,)
+                "INSERT OR REPLACE INTO collector_state (key, last_tick) VALUES ('latest', ?)",
+                (now.isoformat(),)
             )
+        _last_heartbeat_write = now
+        if gap:
+            print(f"🕳️ Collection gap detected: {previous.isoformat()} → {now.isoformat()}")
+    except Exception as e:
+        if gap:
+            _last_tick = previous  # keep the gap open so the next poll records it
+        print(f"❌ Heartbeat write failed: {e}")
+
+def open_slots_where(*statuses: str) -> str:
+    """WHERE clause for unsettled slots in the given statuses, matching idx_slots_open."""
+    quoted = ", ".join(f"'{s}'" for s in statuses)
+    return f"{UNSETTLED} AND status IN ({quoted})"
+
+def close_finished_slots(db: Database, now: datetime):
+    """Close-of-slot transition: promote finished active slots, discard leftover provisional ones."""
+    cutoff = now.isoformat()
+    try:
+        with db.conn:
+            discarded = db.conn.execute(
+                f"DELETE FROM slots WHERE {open_slots_where('provisional')} AND slot_end <= ?",
+                (cutoff,)
+            ).rowcount
+            closed = db.conn.execute(
+                f"UPDATE slots SET status = 'closed' WHERE {open_slots_where('active')} AND slot_end <= ?",
+                (cutoff,)
+            ).rowcount
+        if discarded or closed:
+            print(f"🔒 Closed {closed} slot(s), discarded {discarded} provisional")
+        return True
     except Exception as e:
         if "locked" in str(e).lower():
-            print("🧹 Cleanup skipped (database locked).")
+            print("🔒 Slot close skipped (database locked).")
         else:
-            print(f"🧹 Scheduled cleanup failed: {e}")
+            print(f"🔒 Slot close failed: {e}")
+        return False
+
+def mode_to_signal(mode: str | None) -> str | None:
+    if not mode:
+        return None
+    m = mode.strip().lower()
+    if m in {"fusebox buy", "kratt buy"}:
+        return "DOWN"
+    if m in {"fusebox sell", "kratt sell"}:
+        return "UP"
+    return None
+
+def slot_anchor(dt: datetime) -> datetime:
+    return dt.replace(minute=(dt.minute // 15) * 15, second=0, microsecond=0)
+
+def slot_flags(start_time: datetime, end_time: datetime, timeslot: datetime):
+    """(duration_min, cancelled, was_backup) for an activation recorded from start_time to end_time."""
+    slot_end_time = (timeslot + timedelta(minutes=15)).astimezone(tz)
+    duration = round((end_time - start_time).total_seconds() / 60)
+    cancelled = end_time < (slot_end_time - timedelta(seconds=11))
+    was_backup = (start_time - timeslot).total_seconds() >= 15
+    return duration, cancelled, was_backup
+
+def slot_transition(row, previous, now: datetime, signal: str,
+                    energy_kwh: float, grid_kwh: float, baseline_w: float | None):
+    """
+    Apply one 10 s sample to the slot containing `now`.
+    `row` is the stored slot for that timeslot, `previous` the one before it (or None).
+    Returns (data, is_new): `data` is the update for an existing row or a full
+    row to insert. Returns None when nothing should be written.
+    Shared by the live collector and the history backfill.
+    """
+    timeslot = slot_anchor(now)
+    key = timeslot.isoformat()
+    slot_end_time = (timeslot + timedelta(minutes=15)).astimezone(tz)
+
+    stale = row is not None and row.get("status") == "provisional" and \
+        (now - datetime.fromisoformat(row["end"])).total_seconds() > PROVISIONAL_STALE_SECONDS
+
+    if row and row["signal"] == signal and not stale:
+        end_time = datetime.fromisoformat(row["end"])
+        if end_time >= slot_end_time:
+            return None
+        start_time = datetime.fromisoformat(row["start"])
+        duration, cancelled, was_backup = slot_flags(start_time, now, timeslot)
+
+        update_data = {
+            "timeslot": key,
+            "energy_kwh": round((row["energy_kwh"] or 0) + energy_kwh, 5),
+            "grid_kwh": round((row.get("grid_kwh", 0.0) or 0) + grid_kwh, 5),
+            "end": now.isoformat(),
+            "duration_min": duration,
+            "cancelled": cancelled,
+            "was_backup": was_backup,
+            "slot_end": slot_end_time.isoformat(),
+        }
+        if baseline_w is not None and (row.get("baseline_w") is None):
+            update_data["baseline_w"] = baseline_w
+        if duration > 0:
+            update_data["status"] = "active"
+        return update_data, False
+
+    if (now - timeslot).total_seconds() < 5:
+        return None
+
+    if previous and previous["signal"] == signal:
+        previous_end = datetime.fromisoformat(previous["end"])
+        if abs((now - previous_end).total_seconds()) <= 7:
+            return None
+
+    entry = {
+        "timeslot": key,
+        "start": now.isoformat(),
+        "end": now.isoformat(),
+        "signal": signal,
+        "energy_kwh": energy_kwh,
+        "grid_kwh": grid_kwh,
+        "mffr_price": None,
+        "nordpool_price": None,
+        "profit": None,
+        "duration_min": 0,
+        "cancelled": False,
+        "was_backup": False,
+        "slot_end": slot_end_time.isoformat(),
+        "baseline_w": baseline_w,
+        "status": "provisional",
+    }
+    return entry, True
+
+def merge_slot(row: dict, segment: dict) -> dict | None:
+    """
+    Combine a stored slot with a backfilled segment of the same timeslot.
+    Both cover disjoint ticks (the segment only holds ticks the collector missed),
+    so energies add up and start/end widen. With a different signal the later
+    recording wins, as slot_transition replaces the row on a signal change.
+    Returns the changes for `row`, or None to leave it alone.
+    A closed or settled row goes back to closed so profit_calc settles it again.
+    """
+    reopen = row.get("status") in ("closed", "settled")
+    if row["signal"] != segment["signal"]:
+        if datetime.fromisoformat(segment["end"]) <= datetime.fromisoformat(row["end"]):
+            return None
+        changes = {k: v for k, v in segment.items() if k != "timeslot"}
+        if reopen:
+            changes["status"] = "closed"
+        return changes
+
+    start_time = min(datetime.fromisoformat(row["start"]), datetime.fromisoformat(segment["start"]))
+    end_time = max(datetime.fromisoformat(row["end"]), datetime.fromisoformat(segment["end"]))
+    duration, cancelled, was_backup = slot_flags(start_time, end_time, datetime.fromisoformat(row["timeslot"]))
+    changes = {
+        "start": start_time.isoformat(),
+        "end": end_time.isoformat(),
+        "energy_kwh": round((row["energy_kwh"] or 0) + (segment["energy_kwh"] or 0), 5),
+        "grid_kwh": round((row.get("grid_kwh") or 0) + (segment["grid_kwh"] or 0), 5),
+        "duration_min": duration,
+        "cancelled": cancelled,
+        "was_backup": was_backup,
+    }
+    if row.get("baseline_w") is None:
+        changes["baseline_w"] = segment.get("baseline_w")
+    if row.get("nordpool_price") is None:
+        changes["nordpool_price"] = segment.get("nordpool_price")
+    if reopen:
+        changes["status"] = "closed"
+    elif duration > 0:
+        changes["status"] = "active"
+    return changes
+
+def read_slot(db: Database, key: str) -> dict | None:
+    cursor = db.conn.execute("SELECT * FROM slots WHERE timeslot = ?", (key,))
+    found = cursor.fetchone()
+    return dict(zip([d[0] for d in cursor.description], found)) if found else None
+
+def write_slot(db: Database, key: str, data: dict, is_new: bool):
+    """
+    Store slot_transition/merge_slot output with plain SQL, so it stays inside the
+    caller's transaction (sqlite-utils commits on its own).
+    """
+    if is_new:
+        columns = ", ".join(f"[{c}]" for c in data)
+        placeholders = ", ".join("?" for _ in data)
+        db.conn.execute(
+            f"INSERT OR REPLACE INTO slots ({columns}) VALUES ({placeholders})",
+            list(data.values()),
+        )
+    else:
+        assignments = ", ".join(f"[{c}] = ?" for c in data)
+        db.conn.execute(
+            f"UPDATE slots SET {assignments} WHERE timeslot = ?",
+            [*data.values(), key],
+        )
+
+def mffr_energy_kwh(battery_power_w: float, baseline_w: float | None) -> float:
+    # mffr_power_w = abs(battery_power - baseline), integrated over one 10 s tick
+    mffr_power_w = abs(battery_power_w - baseline_w) if baseline_w is not None else 0.0
+    return round((mffr_power_w / 1000.0) * (10.0 / 3600.0), 5)
+
+def grid_energy_kwh(grid_power_w: float) -> float:
+    return round((grid_power_w / 1000.0) * (10.0 / 3600.0), 5)
 
 def write_current_timeslot():
-    global last_logged_signal
+    global last_logged_signal, _last_closed_slot
     db = Database(DB_PATH)
     _with_busy_timeout(db)
 
     now = datetime.now(tz).replace(microsecond=0)
-    minute = (now.minute // 15) * 15
-    timeslot = now.replace(minute=minute, second=0)
+    timeslot = slot_anchor(now)
     key = timeslot.isoformat()
-    slot_end_time = timeslot + timedelta(minutes=15)
 
-    def mode_to_signal(mode: str | None) -> str | None:
-        if not mode:
-            return None
-        m = mode.strip().lower()
-        if m in {"fusebox buy", "kratt buy"}:
-            return "DOWN"
-        if m in {"fusebox sell", "kratt sell"}:
-            return "UP"
-        return None
+    if timeslot != _last_closed_slot and close_finished_slots(db, now):
+        _last_closed_slot = timeslot
 
     battery_mode = get_sensor_state(SENSOR_MODE)
+    if battery_mode is not None:
+        touch_heartbeat(db, now)
     signal = mode_to_signal(battery_mode)
 
     if signal != last_logged_signal:
@@ -138,18 +419,11 @@ def write_current_timeslot():
     if not signal:
         return
 
-    # Calculate mffr_power_w = abs(battery_power - baseline)
+    baseline_w = get_latest_baseline_w()
     try:
-        battery_power_w = float(get_sensor_state(SENSOR_POWER))
-        baseline_w = get_latest_baseline_w()
-        if baseline_w is not None:
-            mffr_power_w = abs(battery_power_w - baseline_w)
-        else:
-            mffr_power_w = 0.0
+        energy_kwh = mffr_energy_kwh(float(get_sensor_state(SENSOR_POWER)), baseline_w)
     except Exception:
-        mffr_power_w = 0.0
-
-    energy_kwh = round((mffr_power_w / 1000.0) * (10.0 / 3600.0), 5)
+        energy_kwh = 0.0
 
     grid_power_w = 0.0
     gs = get_sensor_state(SENSOR_GRID)
@@ -158,92 +432,36 @@ def write_current_timeslot():
             grid_power_w = float(gs)
         except ValueError:
             pass
-    grid_kwh = round((grid_power_w / 1000.0) * (10.0 / 3600.0), 5)
+    grid_kwh = grid_energy_kwh(grid_power_w)
 
+    # Read-modify-write under the write lock: the backfill merges into this row too
     try:
-        row = db["slots"].get(key)
-    except NotFoundError:
-        row = None
-
-    if row and row["signal"] == signal:
-        end_time = datetime.fromisoformat(row["end"])
-        if end_time < slot_end_time:
-            start_time = datetime.fromisoformat(row["start"])
-            duration = round((now - start_time).total_seconds() / 60)
-            cancelled = now < (slot_end_time - timedelta(seconds=11))
-            was_backup = (start_time - timeslot).total_seconds() >= 15
-
-            update_data = {
-                "timeslot": key,
-                "energy_kwh": round((row["energy_kwh"] or 0) + energy_kwh, 5),
-                "grid_kwh": round((row.get("grid_kwh", 0.0) or 0) + grid_kwh, 5),
-                "end": now.isoformat(),
-                "duration_min": duration,
-                "cancelled": cancelled,
-                "was_backup": was_backup,
-                "slot_end": slot_end_time.isoformat(),
-            }
-            if baseline_w is not None and (row.get("baseline_w") is None):
-                update_data["baseline_w"] = baseline_w
-
-            db["slots"].update(key, update_data)
-    else:
-        if (now - timeslot).total_seconds() < 5:
-            return
-
-        try:
-            prev_slot_time = timeslot - timedelta(minutes=15)
-            previous = db["slots"].get(prev_slot_time.isoformat())
-            previous_end = datetime.fromisoformat(previous["end"])
-            if previous["signal"] == signal and abs((now - previous_end).total_seconds()) <= 7:
-                return
-        except NotFoundError:
-            pass
-
-        entry = {
-            "timeslot": key,
-            "start": now.isoformat(),
-            "end": now.isoformat(),
-            "signal": signal,
-            "energy_kwh": energy_kwh,
-            "grid_kwh": grid_kwh,
-            "mffr_price": None,
-            "nordpool_price": None,
-            "profit": None,
-            "duration_min": 0,
-            "cancelled": False,
-            "was_backup": False,
-            "slot_end": slot_end_time.isoformat(),
-            "baseline_w": baseline_w,
-        }
-        db["slots"].insert(entry, pk="timeslot", replace=True)
+        with db.conn:
+            db.conn.execute("BEGIN IMMEDIATE")
+            row = read_slot(db, key)
+            previous = read_slot(db, (timeslot - timedelta(minutes=15)).astimezone(tz).isoformat())
+            result = slot_transition(row, previous, now, signal, energy_kwh, grid_kwh, baseline_w)
+            if result is not None:
+                write_slot(db, key, *result)
+    except Exception as e:
+        if "locked" in str(e).lower():
+            print("⏭️ Slot write skipped (database locked).")
+        else:
+            print(f"❌ Slot write failed: {e}")
 
     try:
-        resp = requests.get(
-            f"{HA_URL}/api/states/{SENSOR_NORDPOOL}",
-            headers={"Authorization": f"Bearer {HA_TOKEN}", "Content-Type": "application/json"},
-            timeout=5,
-        )
-        attrs = resp.json().get("attributes", {}) if resp.ok else {}
-        raw_today = attrs.get("raw_today", []) or []
-        raw_tomorrow = attrs.get("raw_tomorrow", []) or []
-        for p in (raw_today + raw_tomorrow):
-            start = datetime.fromisoformat(p["start"])
-            end = datetime.fromisoformat(p["end"])
-            if start <= timeslot < end:
-                price = round(p["value"], 5)
-                try:
-                    row = db["slots"].get(key)
-                    if row.get("nordpool_price") is None:
-                        db["slots"].update(key, {"nordpool_price": price})
-                        print(f"📈 Set Nordpool price {price} €/kWh for slot {key}")
-                except NotFoundError:
-                    pass
-                break
+        price = nordpool_price_for(fetch_nordpool_prices(), timeslot)
+        if price is not None:
+            try:
+                row = db["slots"].get(key)
+                if row.get("nordpool_price") is None:
+                    db["slots"].update(key, {"nordpool_price": price})
+                    print(f"📈 Set Nordpool price {price} €/kWh for slot {key}")
+            except NotFoundError:
+                pass
     except Exception as e:
         print(f"❌ Failed to fetch Nordpool price: {e}")
 
 # Scheduler is started by FastAPI (api.py)
 scheduler = BackgroundScheduler()
-scheduler.add_job(write_current_timeslot, 'interval', seconds=10, max_instances=1, coalesce=True)
-scheduler.add_job(cleanup_zero_min_rows, 'interval', minutes=1, max_instances=1, coalesce=True)
\ No newline at end of file
+scheduler.add_job(write_current_timeslot, 'interval', seconds=10, max_instances=1, coalesce=True)
\ No newline at end of file
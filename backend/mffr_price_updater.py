@@ -6,6 +6,8 @@ import pytz
 import time
 import os
 
+import main
+
 DB_PATH = "data/mffr.db"
 LOG_PATH = "logs/mffr_price_fetch_errors.log"
 tz = pytz.timezone("Europe/Tallinn")
@@ -49,7 +51,7 @@ def fetch_and_update_mffr_prices():
             print(msg)
             log_error(msg)
 
-    for row in db["slots"].rows_where("mffr_price IS NULL"):
+    for row in db["slots"].rows_where(main.open_slots_where("active", "closed") + " AND mffr_price IS NULL"):
         try:
             slot_start = datetime.fromisoformat(row["timeslot"])
             mfrr_price = api_data.get(slot_start)
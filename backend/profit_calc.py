@@ -1,9 +1,10 @@
-from datetime import datetime
 from apscheduler.schedulers.background import BackgroundScheduler
 import os
 import pytz
 from sqlite_utils import Database
 
+import main
+
 DB_PATH = "data/mffr.db"
 tz = pytz.timezone("Europe/Tallinn")
 
@@ -20,18 +21,10 @@ scheduler = BackgroundScheduler()
 
 def run_profit_calculation():
     db = Database(DB_PATH)
-    now = datetime.now(tz)
     updated = False
 
-    # Only (re)compute finished slots
-    for row in db["slots"].rows_where("profit IS NULL OR net_total IS NULL"):
-        try:
-            slot_end = datetime.fromisoformat(row["slot_end"])
-            if slot_end > now:
-                continue  # slot still running
-        except Exception:
-            continue
-
+    # Only closed slots: finished, not yet settled
+    for row in db["slots"].rows_where(main.open_slots_where("closed")):
         direction   = row.get("signal")              # "UP" or "DOWN"
         energy_kwh  = row.get("energy_kwh")          # always >= 0 (absolute)
         grid_kwh    = row.get("grid_kwh")            # +import, -export
@@ -103,6 +96,7 @@ def run_profit_calculation():
             continue
 
         if update:
+            update["status"] = "settled"
             db["slots"].update(row["timeslot"], update, alter=True)
             updated = True
             print(f"📊 Updated slot {row['timeslot']} → {update}")